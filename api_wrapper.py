@@ -1,28 +1,276 @@
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+import re
 import requests
+from requests.adapters import HTTPAdapter
+import sqlite3
+import threading
 import time
 import json
+from urllib.parse import parse_qsl, urlencode, urlsplit
 import pandas as pd
 
 
+class TokenBucket:
+    """ Token-bucket rate limiter. Tokens refill continuously at `rate` per second up to
+    `capacity`, and every request takes one. Requests that find the bucket empty reserve
+    a future token and wait for it, so callers are served in arrival order and the
+    long-run rate never goes above `rate`. A capacity of 1 spaces requests evenly;
+    larger capacities allow short bursts after idle periods. Safe to share between
+    threads and asyncio tasks. """
+
+    def __init__(self, rate=3.0, capacity=1):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("rate must be positive and capacity at least 1")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """ Take a token and return how many seconds the caller must wait before using it """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            # a negative balance is a queue of reservations; each waits for its own token
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        """ Block the calling thread until a request may be sent. Returns the time waited """
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        """ Same as acquire, but yields to the event loop instead of blocking it """
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+def make_session(pool_size=10, adapter=None):
+    """ Build a requests Session that keeps connections to the API alive between pages.
+    pool_size is the number of connections kept per host and should be at least the
+    number of threads fetching at once. Pass an adapter to replace the HTTP transport,
+    e.g. with a fake one in tests. """
+    session = requests.Session()
+    if adapter is None:
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class ResponseCache:
+    """ On-disk cache of API responses, stored in SQLite and keyed by the full request URL
+    (endpoint plus filter parameters). Entries are fresh for `ttl` seconds, or for the
+    max-age the server sends; stale entries are revalidated with If-None-Match /
+    If-Modified-Since when the server gave an ETag or Last-Modified. Once the stored
+    bodies exceed max_bytes the least recently used entries are evicted. Thread safe. """
+
+    def __init__(self, path="api_cache.sqlite", ttl=6 * 3600, max_bytes=200 * 2 ** 20):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, body BLOB, "
+                             "etag TEXT, last_modified TEXT, expires REAL, accessed REAL)")
+
+    @staticmethod
+    def key(url, parameters=None):
+        """ Canonical cache key: the URL with its query and the extra parameters merged,
+        de-duplicated and sorted, so a 'next' link and the same page built by hand match """
+        parts = urlsplit(url)
+        query = set(parse_qsl(parts.query)) | {(x, str(y)) for x, y in (parameters or {}).items()}
+        return parts._replace(query=urlencode(sorted(query))).geturl()
+
+    def get(self, url):
+        """ Return (decoded body, is_fresh, validators) for a cached URL, or None """
+        with self._lock:
+            row = self._db.execute("SELECT body, etag, last_modified, expires FROM responses WHERE url = ?",
+                                   (url,)).fetchone()
+            if row is None:
+                return None
+            with self._db:
+                self._db.execute("UPDATE responses SET accessed = ? WHERE url = ?", (time.time(), url))
+        body, etag, last_modified, expires = row
+        validators = {}
+        if etag:
+            validators['If-None-Match'] = etag
+        if last_modified:
+            validators['If-Modified-Since'] = last_modified
+        return json.loads(body), time.time() < expires, validators
+
+    def put(self, url, response, ttl=None):
+        """ Store a successful requests Response. ttl overrides the server's max-age and
+        the cache default for this entry """
+        if ttl is None:
+            max_age = re.search(r"max-age=(\d+)", response.headers.get('Cache-Control', ""))
+            ttl = int(max_age.group(1)) if max_age else self.ttl
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                             (url, response.content, response.headers.get('ETag'),
+                              response.headers.get('Last-Modified'), now + ttl, now))
+            self._evict()
+
+    def refresh(self, url, ttl=None):
+        """ Mark an entry fresh again after the server confirmed it has not changed (304) """
+        with self._lock, self._db:
+            self._db.execute("UPDATE responses SET expires = ?, accessed = ? WHERE url = ?",
+                             (time.time() + (self.ttl if ttl is None else ttl), time.time(), url))
+
+    def _evict(self):
+        """ Drop least recently used entries until the bodies fit in max_bytes (lock held) """
+        total = self._db.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, size in self._db.execute("SELECT url, LENGTH(body) FROM responses ORDER BY accessed").fetchall():
+            self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses")
+
+
 class APIwrapper:
     # class variables shared among all instances
     _access_point = "https://api.ukhsa-dashboard.data.gov.uk"
-    _last_access = 0.0  # time of last api access
+    # one request budget for the whole process: max 3 requests/second
+    _rate_limiter = TokenBucket(rate=3, capacity=1)
+    _session = None  # pooled session shared by all instances, created on first use
+    _session_lock = threading.Lock()
+    _response_cache = None  # optional ResponseCache shared by all instances, see use_response_cache
+    _telemetry = None  # optional telemetry.Telemetry receiving an event per request, see use_telemetry
 
-    def __init__(self, theme, sub_theme, topic, geography_type, geography, metric):
+    def __init__(self, theme, sub_theme, topic, geography_type, geography, metric, rate_limiter=None,
+                 session=None, response_cache=None, telemetry=None):
         """ Init the APIwrapper object, constructing the endpoint from the structure
-        parameters """
+        parameters. All wrappers share APIwrapper._rate_limiter, the pooled session
+        from shared_session(), the response cache and the telemetry (if any) unless
+        others are passed in. """
         # build the path with all the required structure parameters. You do not need to edit this line,
         # parameters will be replaced by the actual values when you instantiate an object of the class!
         url_path = (f"/themes/{theme}/sub_themes/{sub_theme}/topics/{topic}/geography_types/" +
                     f"{geography_type}/geographies/{geography}/metrics/{metric}")
         # our starting API endpoint
         self._start_url = APIwrapper._access_point + url_path
+        self._rate_limiter = rate_limiter or APIwrapper._rate_limiter
+        self._session = session or APIwrapper.shared_session()
+        self._response_cache = response_cache or APIwrapper._response_cache
+        self._telemetry = telemetry or APIwrapper._telemetry
         self._filters = None
         self._page_size = -1
         # will contain the number of items
         self.count = None
 
+    @classmethod
+    def shared_session(cls):
+        """ Return the session shared by all wrappers, creating it on first use """
+        with cls._session_lock:
+            if cls._session is None:
+                cls._session = make_session()
+            return cls._session
+
+    @classmethod
+    def configure_session(cls, pool_size=10, adapter=None):
+        """ Replace the shared session, e.g. to grow the pool for more concurrent
+        fetches or to install a test transport adapter. Returns the new session. """
+        with cls._session_lock:
+            if cls._session is not None:
+                cls._session.close()
+            cls._session = make_session(pool_size, adapter)
+            return cls._session
+
+    @classmethod
+    def use_response_cache(cls, cache):
+        """ Share a ResponseCache between all wrappers (None switches caching off) """
+        cls._response_cache = cache
+
+    @classmethod
+    def use_telemetry(cls, telemetry):
+        """ Send a "request" event for every request of every wrapper to this
+        telemetry.Telemetry (None switches it off) """
+        cls._telemetry = telemetry
+
+    @classmethod
+    def use_access_point(cls, access_point):
+        """ Send the requests of wrappers created from now on to another server, e.g. the
+        local mock API in mock_ukhsa_server.py """
+        cls._access_point = access_point.rstrip("/")
+
+    @classmethod
+    def use_rate_limiter(cls, rate_limiter):
+        """ Replace the rate limiter shared by wrappers created from now on """
+        cls._rate_limiter = rate_limiter
+
+    @classmethod
+    def list_geographies(cls, theme, sub_theme, topic, geography_type):
+        """ Names of all geographies of one type (e.g. every Lower Tier Local Authority,
+        Region or Nation) available for the topic, as listed by the API. The request goes
+        through the shared rate limit and response cache like any other. """
+        url = (cls._access_point + f"/themes/{theme}/sub_themes/{sub_theme}/topics/{topic}/" +
+               f"geography_types/{geography_type}/geographies")
+        # a wrapper without a metric is enough to send the request
+        wrapper = cls(theme, sub_theme, topic, geography_type, geography=None, metric=None)
+        return [geography['name'] for geography in wrapper._request(url, {})]
+
+    def _request(self, url, parameters):
+        """ Send one API request and return the decoded response. Fresh cached responses
+        are returned without touching the network or the rate limit; stale ones are
+        revalidated with the server. Error statuses raise requests.HTTPError. With
+        telemetry, every request emits a "request" event saying where its time went. """
+        cache = self._response_cache
+        cached = None
+        if cache is not None:
+            key = ResponseCache.key(url, parameters)
+            cached = cache.get(key)
+            if cached is not None and cached[1]:
+                self._report(url, parameters, 200, cached[0], cached=True)
+                return cached[0]
+        # rate limiting to avoid bans; the limiter is shared, so concurrent
+        # fetchers queue up here instead of firing together
+        wait = self._rate_limiter.acquire()
+        headers = cached[2] if cached is not None else None
+        start = time.perf_counter()
+        response = self._session.get(url, params=parameters, headers=headers)
+        network = time.perf_counter() - start
+        if cached is not None and response.status_code == 304:
+            cache.refresh(key)  # unchanged on the server, keep using our copy
+            self._report(url, parameters, 304, cached[0], cached=True, wait=wait, network=network)
+            return cached[0]
+        if not response.ok:
+            self._report(url, parameters, response.status_code, None, len(response.content), wait=wait,
+                         network=network)
+            response.raise_for_status()
+        if cache is not None:
+            cache.put(key, response)
+        start = time.perf_counter()
+        body = response.json()
+        parse = time.perf_counter() - start
+        self._report(url, parameters, response.status_code, body, len(response.content), wait=wait,
+                     network=network, parse=parse)
+        return body
+
+    def _report(self, url, parameters, status, body, n_bytes=None, cached=False, wait=0.0, network=0.0,
+                parse=0.0):
+        """ Emit the telemetry event of one request (does nothing without telemetry) """
+        if self._telemetry is None:
+            return
+        rows = len(body['results']) if isinstance(body, dict) and 'results' in body else None
+        self._telemetry.emit("request", url=ResponseCache.key(url, parameters), status=status, bytes=n_bytes,
+                             rows=rows, cached=cached, rate_limit_wait_s=wait, network_s=network, parse_s=parse)
+
     def get_page(self, filters={}, page_size=5):
         """ Access the API and download the next page of data. Sets the count
         attribute to the total number of items available for this query. Changing
@@ -41,42 +289,73 @@ class APIwrapper:
         # signal the end of data condition
         if self._next_url == None:
             return []  # we already fetched the last page
-        # simple rate limiting to avoid bans
-        curr_time = time.time()  # Unix time: number of seconds since the Epoch
-        deltat = curr_time - APIwrapper._last_access
-        if deltat < 0.33:  # max 3 requests/second
-            time.sleep(0.33 - deltat)
-        APIwrapper._last_access = curr_time
         # build parameter dictionary by removing all the None
         # values from filters and adding page_size
         parameters = {x: y for x, y in filters.items() if y != None}
         parameters['page_size'] = page_size
         # the page parameter is already included in _next_url.
-        # This is the API access. Response is a dictionary with various keys.
+        # This is the API access (rate limited, cached if a response cache is set), over the
+        # pooled keep-alive session. Response is a dictionary with various keys.
         # the .json() method decodes the response into Python object (dictionaries,
         # lists; 'null' values are translated as None).
-        response = requests.get(self._next_url, params=parameters).json()
+        response = self._request(self._next_url, parameters)
         # update url so we'll fetch the next page
         self._next_url = response['next']
         self.count = response['count']
         # data are in the nested 'results' list
         return response['results']
 
-    def get_all_pages(self, filters={}, page_size=365):
+    def get_all_pages(self, filters={}, page_size=365, max_workers=1):
         """ Access the API and download all available data pages of data. Sets the count
         attribute to the total number of items available for this query. API access rate
         limited to three request per second. The page_size parameter sets the number
         of data points in one response page (maximum 365), and controls the trade-off
-        between time to load a page and number of pages; the default should work well 
-        in most cases. The number of items returned should in any case be equal to 
-        the count attribute. """
+        between time to load a page and number of pages; the default (the maximum)
+        needs the fewest requests. The number of items returned should in any case be
+        equal to the count attribute. With max_workers above 1, the remaining pages are
+        fetched concurrently once the first page has told us how many there are. """
         data = []  # build up all data here
+        for next_page in self.iter_pages(filters, page_size, max_workers):
+            data.extend(next_page)
+        return data
+
+    def iter_pages(self, filters={}, page_size=365, max_workers=1):
+        """ Yield the result pages of the query in order, as they arrive, so callers can
+        convert each page before the next one is downloaded. Same parameters as
+        get_all_pages. """
+        if max_workers > 1:
+            yield from self._iter_pages_concurrently(filters, page_size, max_workers)
+            return
         while True:
             # use get_page to do the job, including the pacing
             next_page = self.get_page(filters, page_size)
             if next_page == []:
                 break  # we are done
-            data.extend(next_page)
-        return data
+            yield next_page
+
+    def _iter_pages_concurrently(self, filters, page_size, max_workers):
+        """ Fetch page 1 with get_page, work out the URLs of the other pages from the
+        count, then fetch them on a thread pool (still within the shared rate limit)
+        and hand them back in page order """
+        self._filters = None  # make get_page start again from page 1
+        first_page = self.get_page(filters, page_size)
+        if first_page:
+            yield first_page
+        if self._next_url is None:
+            return  # everything fitted on the first page
+        n_pages = math.ceil(self.count / page_size)
+        parameters = {x: y for x, y in filters.items() if y != None}
+        parameters['page_size'] = page_size
 
+        def fetch_page(page):
+            return self._request(self._start_url, {**parameters, 'page': page})['results']
 
+        n_items = len(first_page)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # map returns the pages in the order they were asked for
+            for results in pool.map(fetch_page, range(2, n_pages + 1)):
+                n_items += len(results)
+                yield results
+        self._next_url = None  # we already fetched the last page
+        if n_items != self.count:
+            raise RuntimeError(f"Expected {self.count} items but the pages contained {n_items}")
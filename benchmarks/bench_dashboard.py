@@ -0,0 +1,209 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from data_store import load_cases, save_cases, memory_report
+from part_2_wrangle_timeseries import group_by_week
+from part_2_merge_linear_cases import prepare_data
+from part_2_visualise_lineages_cases import LineageVisualiser
+from benchmarks.notebook import load_notebook
+
+"""
+Benchmark of the dashboard's interactive hot paths on synthetic data.
+
+Synthetic combined frames with the real schema are generated at 1x, 10x and 100x the
+size of the shipped data set (more boroughs over the same dates, as when scaling out
+beyond London). For each size it times, with tracemalloc peak memory:
+- load: load_initial_data from the columnar store and from the gzipped JSON export
+- index: building the CasesIndex
+- filter: CasesIndex.select for every year/month/borough combination
+- render: drawing that selection to PNG (render_cases, bypassing the render cache)
+- plot_cached: plot_cases for a selection already in the render cache
+- lineage_join: weekly cases of every borough joined with synthetic lineage data (prepare_data)
+- lineage_render: the stacked strain chart (LineageVisualiser.render) for all and for a few strains
+
+Results are written as JSON; --compare prints the ratio to an earlier run and flags
+slowdowns, so two runs can be checked for regressions.
+
+Run from the repository root:
+    python -m benchmarks.bench_dashboard --scales 1 10 100 --json dashboard.json
+"""
+
+BASE_FILE = "combined_df.npz"
+
+
+def synthetic_cases(base, scale, seed=0):
+    """ Cases frame in the compact schema with `scale` times the boroughs of `base` over the
+    same dates. Boroughs beyond the real ones are named "<borough> #<copy>". """
+    rng = np.random.default_rng(seed)
+    days = np.arange(base["date"].min(), base["date"].max() + 1, dtype=np.int32)
+    real = list(base["borough"].cat.categories)
+    names = [name if copy == 0 else f"{name} #{copy}" for copy in range(scale) for name in real]
+    n_boroughs, n_days = len(names), len(days)
+
+    # one random walk per borough, like a daily case count
+    steps = rng.normal(0, 0.08, size=(n_boroughs, n_days))
+    values = np.round(rng.uniform(20, 200, size=(n_boroughs, 1)) * np.exp(np.cumsum(steps, axis=1)))
+    codes = np.repeat(np.arange(n_boroughs), n_days)
+    frame = {}
+    for column in base.columns:
+        if column in ("geography", "borough"):
+            frame[column] = pd.Categorical.from_codes(codes, categories=names)
+        elif column == "geography_code":
+            frame[column] = pd.Categorical.from_codes(codes, categories=[f"E9{i:07d}" for i in range(n_boroughs)])
+        elif isinstance(base[column].dtype, pd.CategoricalDtype):
+            frame[column] = pd.Categorical.from_codes(np.zeros(len(codes), dtype=np.int8),
+                                                      categories=[base[column].iloc[0]])
+    frame["date"] = np.tile(days, n_boroughs)
+    frame["metric_value"] = values.ravel().astype(np.float32)
+    frame["in_reporting_delay_period"] = np.tile(np.arange(n_days) >= n_days - 5, n_boroughs)
+    return pd.DataFrame(frame)[list(base.columns)]
+
+
+def synthetic_lineages(weeks, n_strains, seed=0):
+    """ Lineage data as in the lineage pickle: percentages per strain (columns) and week (index),
+    each strain rising and falling once over the weeks. """
+    rng = np.random.default_rng(seed)
+    position = np.linspace(0, 1, len(weeks))[:, None]
+    peaks, widths = rng.uniform(0, 1, n_strains), rng.uniform(0.03, 0.2, n_strains)
+    shares = np.exp(-((position - peaks) / widths) ** 2) + 1e-6
+    percentages = shares / shares.sum(axis=1, keepdims=True) * 100
+    return pd.DataFrame(percentages, index=pd.DatetimeIndex(weeks).strftime("%Y-%m-%d"),
+                        columns=[f"B.1.{strain}" for strain in range(n_strains)])
+
+
+def measure(stage, run, repeat=1, trace_memory=True, **params):
+    """ Time run() `repeat` times (memory is traced on the first run only) and return one result row """
+    times = []
+    peak = None
+    for attempt in range(repeat):
+        if trace_memory and attempt == 0:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run()
+        times.append(time.perf_counter() - start)
+        if trace_memory and attempt == 0:
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+    return {"stage": stage, **params, "seconds_min": min(times), "seconds_median": statistics.median(times),
+            "peak_memory_mb": peak}
+
+
+def filter_combinations(index):
+    """ Year x month x borough selections, as the widgets would pass them """
+    years = [None, (index.first_year + index.last_year) // 2]
+    months = [None, 6]
+    boroughs = [None, index.boroughs[:1], index.boroughs[:5]]
+    return [(year, month, selection) for year in years for month in months for selection in boroughs]
+
+
+def bench_scale(notebook, base, scale, workdir, args):
+    """ All measurements for one synthetic data size """
+    cases_df = synthetic_cases(base, scale, args.seed)
+    common = {"scale": scale, "rows": len(cases_df)}
+    trace_memory = not args.no_memory
+    results = []
+
+    for extension in args.formats:
+        path = os.path.join(workdir, f"cases_{scale}x.{extension}")
+        save_cases(cases_df, path)
+        results.append(measure("load", lambda: notebook["load_initial_data"](path, fallback=path), args.repeat,
+                               trace_memory, format=extension, file_mb=os.path.getsize(path) / 2 ** 20, **common))
+    common["frame_mb"] = memory_report(cases_df).loc["total", "bytes"] / 2 ** 20
+
+    results.append(measure("index", lambda: notebook["CasesIndex"](cases_df), args.repeat, trace_memory, **common))
+    index = notebook["index_for"](cases_df)
+    for year, month, boroughs in filter_combinations(index):
+        params = {"year": year, "month": month, "boroughs": len(boroughs) if boroughs else "all", **common}
+        results.append(measure("filter", lambda: index.select(year, month, boroughs), args.repeat, trace_memory,
+                               **params))
+        results.append(measure("render", lambda: notebook["render_cases"](index, year, month, boroughs),
+                               args.repeat, trace_memory, **params))
+        with contextlib.redirect_stdout(io.StringIO()):
+            notebook["plot_cases"](cases_df, year, month, boroughs)  # fill the render cache
+        results.append(measure("plot_cached", lambda: notebook["plot_cases"](cases_df, year, month, boroughs),
+                               args.repeat, trace_memory, **params))
+
+    weekly_cases = group_by_week(cases_df, "metric_value", by=("geography",))
+    lineages = synthetic_lineages(weekly_cases["week_start"].unique(), args.strains, args.seed)
+    common["strains"] = args.strains
+    def join():
+        return prepare_data(weekly_cases, lineages, "metric_value", by="geography")
+
+    results.append(measure("lineage_join", join, args.repeat, trace_memory, **common))
+    visualiser = LineageVisualiser(join())
+    for strains in (None, visualiser.strain_columns[:5]):
+        results.append(measure("lineage_render", lambda: visualiser.render(strains), args.repeat, trace_memory,
+                               selected=len(strains) if strains else "all", **common))
+    return results
+
+
+def result_key(result):
+    return tuple((name, value) for name, value in result.items()
+                 if name not in ("seconds_min", "seconds_median", "peak_memory_mb", "file_mb", "frame_mb"))
+
+
+def compare(results, previous_path, threshold):
+    """ Print the runs whose time changed against an earlier results file; slowdowns over threshold are flagged """
+    with open(previous_path) as file:
+        previous = {result_key(result): result for result in json.load(file)["results"]}
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None or not before["seconds_median"]:
+            continue
+        ratio = result["seconds_median"] / before["seconds_median"]
+        if ratio > threshold:
+            flag = "SLOWER"
+        elif ratio < 1 / threshold:
+            flag = "faster"
+        else:
+            continue
+        label = ", ".join(f"{name}={value}" for name, value in result_key(result))
+        print(f"{flag:>6} {ratio:5.2f}x  {label}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading, filtering and plotting on synthetic data")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100],
+                        help="data sizes, as multiples of the shipped data set")
+    parser.add_argument("--formats", nargs="+", default=["npz", "json.gz"], choices=["npz", "json.gz"])
+    parser.add_argument("--strains", type=int, default=50, help="strains in the synthetic lineage data")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, for undistorted timings")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="ratio reported as a change by --compare")
+    args = parser.parse_args()
+
+    notebook = load_notebook()
+    base = load_cases(BASE_FILE)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in args.scales:
+            results.extend(bench_scale(notebook, base, scale, workdir, args))
+
+    # slowest selection of each stage (and format, for loading)
+    summary = pd.DataFrame(results).groupby(["scale", "stage", "format"], sort=False, dropna=False)
+    print(summary[["seconds_median", "peak_memory_mb"]].max().to_string(float_format=lambda value: f"{value:.4f}"))
+    if args.json:
+        environment = {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+                       "machine": platform.machine()}
+        with open(args.json, "w") as file:
+            json.dump({"config": vars(args), "environment": environment, "results": results}, file, indent=2)
+    if args.compare:
+        compare(results, args.compare, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
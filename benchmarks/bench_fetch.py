@@ -0,0 +1,126 @@
+import argparse
+import contextlib
+import io
+import json
+import time
+import tracemalloc
+import pandas as pd
+import requests
+
+from api_wrapper import APIwrapper, TokenBucket
+from mock_ukhsa_server import MockServerProcess
+from benchmarks.notebook import load_notebook
+
+"""
+Throughput benchmark of the fetch pipeline against the local mock API (mock_ukhsa_server.py).
+
+For 1, 32 and 300 geographies it times three levels of the pipeline:
+- get_all_pages: APIwrapper alone, one geography after the other
+- fetch_data_with_wrapper: the wrapper plus conversion to a typed DataFrame
+- fetch_all_boroughs: the notebook's Fetcher, with its worker threads
+
+and reports requests/s, rows/s, wall time and peak Python memory (tracemalloc) of each.
+The mock server runs in its own process, so its work is not counted. By default the rate
+limit is lifted to measure our own overhead; use --rate 3 to reproduce the real API limit.
+
+Run from the repository root:
+    python -m benchmarks.bench_fetch --geographies 1 32 300 --latency 0.02 --json fetch.json
+"""
+
+STRUCTURE = {"theme": "infectious_disease", "sub_theme": "respiratory", "topic": "COVID-19",
+             "geography_type": "Lower%20Tier%20Local%20Authority"}
+METRIC = "COVID-19_cases_casesByDay"
+
+
+def server_stats(server):
+    return requests.get(server.url + "/__stats__").json()
+
+
+def measure(server, benchmark, geographies, run, trace_memory=True):
+    """ Run one benchmark and return its measurements. run() returns (rows, failed geographies). """
+    before = server_stats(server)
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # the Fetcher reports every borough
+        rows, failed = run()
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+    after = server_stats(server)
+    n_requests = after["requests"] - before["requests"]
+    return {"benchmark": benchmark, "geographies": len(geographies), "requests": n_requests,
+            "errors": after["errors"] - before["errors"], "failed_geographies": failed, "rows": rows,
+            "wall_s": wall, "requests_per_s": n_requests / wall, "rows_per_s": rows / wall,
+            "peak_memory_mb": peak / 2 ** 20 if peak is not None else None}
+
+
+def run_get_all_pages(geographies):
+    rows = failed = 0
+    for geography in geographies:
+        try:
+            rows += len(APIwrapper(geography=geography, metric=METRIC, **STRUCTURE).get_all_pages())
+        except Exception:
+            failed += 1
+    return rows, failed
+
+
+def run_fetch_data_with_wrapper(notebook, geographies):
+    rows = failed = 0
+    for geography in geographies:
+        try:
+            rows += len(notebook["fetch_data_with_wrapper"](STRUCTURE["geography_type"], geography, METRIC))
+        except Exception:
+            failed += 1
+    return rows, failed
+
+
+def run_fetch_all_boroughs(notebook, geographies, workers):
+    fetcher = notebook["Fetcher"](STRUCTURE["geography_type"], METRIC, max_workers=workers)
+    data = fetcher.fetch_all_boroughs(geographies)
+    fetched = data["borough"].nunique() if not data.empty else 0
+    return len(data), len(geographies) - fetched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fetch pipeline against the mock UKHSA API")
+    parser.add_argument("--geographies", type=int, nargs="+", default=[1, 32, 300])
+    parser.add_argument("--days", type=int, default=3 * 365, help="days of data per geography")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock server latency per request (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with 503")
+    parser.add_argument("--rate", type=float, default=1e6, help="API rate limit in requests/s (real API: 3)")
+    parser.add_argument("--workers", type=int, default=4, help="Fetcher max_workers for fetch_all_boroughs")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, for undistorted timings")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    notebook = load_notebook()
+    APIwrapper.use_rate_limiter(TokenBucket(rate=args.rate, capacity=1))
+    APIwrapper.use_response_cache(None)  # every request must reach the server
+    APIwrapper.configure_session(pool_size=args.workers)
+
+    results = []
+    with MockServerProcess(n_days=args.days, n_geographies=max(args.geographies), latency=args.latency,
+                           error_rate=args.error_rate) as server:
+        APIwrapper.use_access_point(server.url)
+        # geography names as the notebook spells them, with %20 for spaces
+        names = [name.replace(" ", "%20") for name in APIwrapper.list_geographies(**STRUCTURE)]
+        for n in args.geographies:
+            geographies = names[:n]
+            trace_memory = not args.no_memory
+            results.append(measure(server, "get_all_pages", geographies,
+                                   lambda: run_get_all_pages(geographies), trace_memory))
+            results.append(measure(server, "fetch_data_with_wrapper", geographies,
+                                   lambda: run_fetch_data_with_wrapper(notebook, geographies), trace_memory))
+            results.append(measure(server, "fetch_all_boroughs", geographies,
+                                   lambda: run_fetch_all_boroughs(notebook, geographies, args.workers), trace_memory))
+
+    print(pd.DataFrame(results).to_string(index=False, float_format=lambda value: f"{value:.2f}"))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"config": vars(args), "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
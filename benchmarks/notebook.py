@@ -0,0 +1,38 @@
+import contextlib
+import io
+import json
+import os
+
+"""
+Load the dashboard's functions and classes (fetch_data_with_wrapper, Fetcher, plot_cases, ...)
+from covid-dashboard.ipynb, so benchmarks measure the code the notebook actually runs.
+
+Only the cells that define things are executed: the imports, the fetch functions, the
+global parameters and the plotting functions. Cells that fetch, load data or build widgets
+are skipped, and IPython magics (%matplotlib) are dropped.
+"""
+
+NOTEBOOK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "covid-dashboard.ipynb")
+
+# first line of each cell to execute
+DEFINITION_CELLS = ("from IPython.display import",
+                    "# ----------------------------------- MODULARISE WITH WRAPPER",
+                    "# ----------------------------------- SET UP FETCHER",
+                    "# ----------------------------------- TIME FOR ACTION",
+                    "# Output widget for rendering plots")
+
+
+def load_notebook(path=NOTEBOOK_PATH):
+    """ Execute the definition cells of the notebook and return their namespace as a dict """
+    with open(path, encoding="utf-8") as file:
+        cells = json.load(file)["cells"]
+    os.environ.setdefault("MPLBACKEND", "Agg")  # no display needed for the plots
+    namespace = {"__name__": "covid_dashboard"}
+    for cell in cells:
+        source = "".join(cell["source"])
+        if cell["cell_type"] != "code" or not source.startswith(DEFINITION_CELLS):
+            continue
+        code = "\n".join(line for line in source.splitlines() if not line.lstrip().startswith("%"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            exec(compile(code, path, "exec"), namespace)
+    return namespace
@@ -0,0 +1,111 @@
+import itertools
+import numpy as np
+import pandas as pd
+
+import derived_series
+from part_2_wrangle_timeseries import as_days
+
+"""
+Time-series index over the combined cases DataFrame, built once when data is loaded.
+
+Rows are sorted by (borough, date), so each borough is one contiguous block and dates
+are sorted inside it. A year/month/borough selection then becomes a few binary searches
+and slices instead of full-frame boolean masks.
+
+The derived series (rolling mean, cumulative total, week-over-week growth, see
+derived_series.py) are computed when the index is built, aligned with its rows, so any of
+them plots as cheaply as the raw values. Building from a previous index only recomputes
+the days that changed.
+"""
+
+_version_counter = itertools.count(1)
+
+
+class CasesIndex:
+    """ Sorted, sliceable view of the cases DataFrame. `version` changes every time an index is
+    built, so it can be used to tell data sets apart (e.g. in caches). Pass the index of the
+    data this frame replaces as `previous` to update its derived series incrementally. """
+
+    def __init__(self, cases_df, value_column="metric_value", metric=None, previous=None):
+        self.source = cases_df  # the frame this index was built from
+        self.version = next(_version_counter)
+        # A long frame can hold several metrics per (borough, date); index one of them
+        if "metric" in cases_df.columns and cases_df["metric"].nunique() > 1:
+            metric = metric if metric is not None else sorted(cases_df["metric"].unique())[0]
+        if metric is not None:
+            cases_df = cases_df[cases_df["metric"] == metric]
+        self.metric = metric
+        self.value_column = value_column
+        codes, self.boroughs = pd.factorize(cases_df["borough"], sort=True)
+        self.boroughs = list(self.boroughs)
+        days = as_days(cases_df["date"])
+        order = np.lexsort((days, codes))  # by borough, then by date
+
+        self.days = days[order]
+        self.values = cases_df[value_column].to_numpy(dtype=float)[order]
+        # borough i occupies rows offsets[i]:offsets[i + 1]
+        self.offsets = np.searchsorted(codes[order], np.arange(len(self.boroughs) + 1))
+        self._positions = {borough: i for i, borough in enumerate(self.boroughs)}
+        if previous is not None and previous.metric == self.metric and previous.value_column == value_column:
+            self.derived, self.recomputed_rows = derived_series.update(previous, self.days, self.values, self.offsets,
+                                                                       self.boroughs, previous.derived)
+        else:
+            self.derived = derived_series.compute(self.days, self.values, self.offsets)
+            self.recomputed_rows = len(self.days)
+        if len(self.days):
+            self.first_year = pd.Timestamp(self.days.min(), unit="D").year
+            self.last_year = pd.Timestamp(self.days.max(), unit="D").year
+        else:
+            self.first_year = self.last_year = None
+
+    def date_ranges(self, year=None, month=None):
+        """ Half-open [start, end) day ranges covering the year/month selection. A month without
+        a year gives that month in every year of the data. None means everything. """
+        if year is None and month is None:
+            return None
+        if self.first_year is None:
+            return []
+        years = [int(year)] if year is not None else range(self.first_year, self.last_year + 1)
+        ranges = []
+        for y in years:
+            if month is None:
+                start, end = np.datetime64(f"{y:04d}-01"), np.datetime64(f"{y + 1:04d}-01")
+            else:
+                start = np.datetime64(f"{y:04d}-{int(month):02d}")
+                end = start + np.timedelta64(1, "M")
+            ranges.append((as_days(start.astype("datetime64[D]")), as_days(end.astype("datetime64[D]"))))
+        return ranges
+
+    def rows(self, borough, ranges=None):
+        """ Positions of one borough's rows (in date order) inside the selected day ranges, as a
+        slice when possible or an index array when the selection has several ranges """
+        position = self._positions.get(borough)
+        if position is None:
+            return slice(0, 0)
+        lo, hi = self.offsets[position], self.offsets[position + 1]
+        if ranges is None:
+            return slice(lo, hi)
+        bounds = [(lo + np.searchsorted(self.days[lo:hi], start), lo + np.searchsorted(self.days[lo:hi], end))
+                  for start, end in ranges]
+        if len(bounds) == 1:
+            return slice(*bounds[0])
+        return np.concatenate([np.arange(start, end) for start, end in bounds])
+
+    def select(self, year=None, month=None, boroughs=None):
+        """ Map each selected borough (all boroughs when None) to its row positions for the year and
+        month selection. Boroughs with no rows in the selection are left out. """
+        ranges = self.date_ranges(year, month)
+        selection = {}
+        for borough in (self.boroughs if boroughs is None else sorted(boroughs)):
+            rows = self.rows(borough, ranges)
+            if len(self.days[rows]):
+                selection[borough] = rows
+        return selection
+
+    def series(self, name="daily"):
+        """ Values of one series for every row: "daily" (the raw values) or a derived series """
+        return self.values if name == "daily" else self.derived[name]
+
+    def dates(self, rows):
+        """ Dates of the given row positions as datetime64 values """
+        return self.days[rows].astype("datetime64[D]")
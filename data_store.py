@@ -0,0 +1,370 @@
+import gzip
+import json
+from array import array
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+"""
+On-disk storage for the combined cases DataFrame.
+
+The main format is a compressed NumPy .npz archive holding one array per column:
+- string columns are dictionary encoded, stored as small integer codes plus the list
+  of distinct values (most columns, such as theme or geography_type, have one value)
+- the date column is stored as typed datetime64 days, or int32 day numbers for frames in
+  the compact schema (apply_compact_schema)
+- numeric and boolean columns are stored as they are
+
+The gzipped JSON records file used so far is still supported for import and export.
+It is read as a stream, record by record, straight into typed column buffers, so large
+files never exist in memory as one decoded list of dicts. API result pages are turned
+into typed columns the same way (PageColumns), one page at a time.
+"""
+
+# Compact in-memory schema of the combined cases frame (see apply_compact_schema)
+CATEGORY_COLUMNS = ("theme", "sub_theme", "topic", "geography_type", "geography", "geography_code", "metric",
+                    "metric_group", "stratum", "sex", "age", "borough")
+DERIVED_COLUMNS = ("year", "month", "epiweek")  # recomputed from date when needed, see calendar_column
+SCHEMA_COLUMNS = CATEGORY_COLUMNS + ("date", "metric_value", "in_reporting_delay_period")  # all that is kept
+
+_CODES = "{}__codes"  # array names used for dictionary-encoded columns
+_CATEGORIES = "{}__categories"
+
+
+def _code_dtype(n_categories):
+    """ Smallest integer type that can index n_categories values (-1 marks missing) """
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def days_to_datetime(days):
+    """ Convert the schema's int32 day numbers (days since 1970-01-01) to datetime64 """
+    return np.asarray(days, dtype=np.int64).astype("datetime64[D]")
+
+
+def apply_compact_schema(df):
+    """ Return the cases frame in the compact schema:
+    - text columns (geography, metric, borough...) as categoricals
+    - date as int32 days since 1970-01-01
+    - metric_value as float32 when that loses nothing, otherwise float64
+    - no stored year/month/epiweek columns (use calendar_column)
+    Frames already in the schema are returned unchanged. """
+    derived = [column for column in DERIVED_COLUMNS if column in df.columns]
+    if derived:
+        df = df.drop(columns=derived)
+    columns = {}
+    if "date" in df.columns and df["date"].dtype != np.int32:
+        if pd.api.types.is_datetime64_any_dtype(df["date"]):
+            columns["date"] = df["date"].to_numpy(dtype="datetime64[D]").astype(np.int64).astype(np.int32)
+        else:
+            columns["date"] = df["date"].to_numpy(dtype=np.int32)
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            columns[column] = df[column].astype("category")
+    if "metric_value" in df.columns and df["metric_value"].dtype == np.float64:
+        values = df["metric_value"].to_numpy()
+        narrow = values.astype(np.float32)
+        if np.array_equal(narrow.astype(np.float64), values, equal_nan=True):
+            columns["metric_value"] = narrow
+    if "in_reporting_delay_period" in df.columns and df["in_reporting_delay_period"].dtype != bool:
+        if not df["in_reporting_delay_period"].isna().any():
+            columns["in_reporting_delay_period"] = df["in_reporting_delay_period"].astype(bool)
+    return df.assign(**columns) if columns else df
+
+
+def calendar_column(df, part):
+    """ Compute a calendar column ("year", "month" or "epiweek") from the date column on demand """
+    dates = pd.Series(days_to_datetime(df["date"]), index=df.index)
+    if part == "epiweek":
+        return dates.dt.isocalendar().week.astype(np.int8)
+    if part == "year":
+        return dates.dt.year.astype(np.int16)
+    if part == "month":
+        return dates.dt.month.astype(np.int8)
+    raise ValueError(f"Unknown calendar column {part!r}")
+
+
+def memory_report(df):
+    """ Memory used by each column of the frame (dtype, total bytes, bytes per row), with a total row """
+    usage = df.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({"dtype": df.dtypes.astype(str), "bytes": usage,
+                           "bytes_per_row": usage / max(len(df), 1)})
+    report.loc["total"] = ["", usage.sum(), usage.sum() / max(len(df), 1)]
+    return report
+
+
+def save_columnar(df, filepath="combined_df.npz"):
+    """ Save the DataFrame as a compressed columnar .npz archive """
+    arrays = {"__columns__": np.array(df.columns, dtype=str)}
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            arrays[column] = values.to_numpy(dtype="datetime64[D]")
+        elif pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            arrays[column] = values.to_numpy()
+        else:
+            codes, categories = pd.factorize(values, sort=True)
+            arrays[_CODES.format(column)] = codes.astype(_code_dtype(len(categories)))
+            arrays[_CATEGORIES.format(column)] = np.asarray(categories, dtype=str)
+    np.savez_compressed(filepath, **arrays)
+
+
+def load_columnar(filepath="combined_df.npz", columns=None):
+    """ Load a DataFrame saved by save_columnar, optionally keeping only some columns. String
+    columns come back as categoricals and the date column as datetime64 """
+    with np.load(filepath, allow_pickle=False) as archive:
+        data = {}
+        for column in archive["__columns__"]:
+            if columns is not None and column not in columns:
+                continue
+            if column in archive.files:
+                values = archive[column]
+                if values.dtype.kind == "M":
+                    values = values.astype("datetime64[ns]")
+                data[column] = values
+            else:
+                data[column] = pd.Categorical.from_codes(archive[_CODES.format(column)],
+                                                         categories=archive[_CATEGORIES.format(column)])
+    return pd.DataFrame(data)
+
+
+def save_json_records(df, filepath="combined_df.json.gz"):
+    """ Export the DataFrame as gzipped JSON records (dates as epoch milliseconds) """
+    if "date" in df.columns and pd.api.types.is_integer_dtype(df["date"]):
+        df = df.assign(date=days_to_datetime(df["date"]).astype("datetime64[ns]"))  # the compact schema keeps days
+    with gzip.open(filepath, "wt") as f:
+        df.to_json(f, orient="records")
+
+
+def iter_json_records(filepath, chunk_size=1 << 16):
+    """ Yield the records of a gzipped JSON array one at a time, decompressing and decoding
+    chunk by chunk instead of loading the whole document """
+    decoder = json.JSONDecoder()
+    with gzip.open(filepath, "rt") as f:
+        buffer, pos, started = "", 0, False
+        eof = False
+        while True:
+            # skip whitespace and separators between records
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer):
+                if not started:
+                    if buffer[pos] != "[":
+                        raise ValueError(f"{filepath} does not contain a JSON array of records")
+                    started = True
+                    pos += 1
+                    continue
+                if buffer[pos] == "]":
+                    return
+                try:
+                    record, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    # the record continues in the next chunk
+                else:
+                    yield record
+                    pos = end
+                    continue
+            elif eof:
+                raise ValueError(f"{filepath} ended before the JSON array was closed")
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+
+
+class _ColumnBuffer:
+    """ Growable typed buffer for one column. The type is taken from the first value seen:
+    bool, int or float values go into a compact array, strings are dictionary encoded.
+    Integer and boolean columns that later meet a float or a missing value are widened to
+    float (missing values become NaN). """
+
+    def __init__(self):
+        self.kind = None  # "b", "q", "d" or "str"
+        self.values = None
+        self.categories = {}
+
+    def _start(self, value, n_before):
+        if isinstance(value, bool):
+            self.kind = "b"
+        elif isinstance(value, int):
+            self.kind = "q"
+        elif isinstance(value, float):
+            self.kind = "d"
+        else:
+            self.kind = "str"
+        self.values = array("i" if self.kind == "str" else self.kind)
+        for _ in range(n_before):  # rows seen before the first non-missing value
+            self.append(None)
+
+    def append(self, value):
+        if self.kind == "str":
+            self.values.append(-1 if value is None else self.categories.setdefault(value, len(self.categories)))
+        elif self.kind in ("b", "q") and (value is None or isinstance(value, float)):
+            self.kind, self.values = "d", array("d", self.values)
+            self.append(value)
+        elif self.kind == "d":
+            self.values.append(float("nan") if value is None else value)
+        else:
+            self.values.append(value)
+
+    def to_series(self, n_rows):
+        if self.kind is None:
+            return pd.Series([None] * n_rows, dtype=object)
+        values = np.frombuffer(self.values, dtype=self.values.typecode).copy()
+        if self.kind == "str":
+            return pd.Series(pd.Categorical.from_codes(values, categories=list(self.categories)))
+        return pd.Series(values.astype(bool) if self.kind == "b" else values)
+
+
+def load_json_columns(filepath, columns=None):
+    """ Stream a gzipped JSON records file into a DataFrame, keeping only the given columns
+    (all columns when None). Peak memory follows the size of the output columns. """
+    buffers = {}
+    n_rows = 0
+    for record in iter_json_records(filepath):
+        for column, buffer in buffers.items():
+            if column not in record and buffer.kind is not None:
+                buffer.append(None)
+        for column, value in record.items():
+            if columns is not None and column not in columns:
+                continue
+            buffer = buffers.get(column)
+            if buffer is None:
+                buffer = buffers[column] = _ColumnBuffer()
+            if buffer.kind is None:
+                if value is not None:
+                    buffer._start(value, n_rows)
+                    buffer.append(value)
+            else:
+                buffer.append(value)
+        n_rows += 1
+    return pd.DataFrame({column: buffer.to_series(n_rows) for column, buffer in buffers.items()})
+
+
+def load_json_records(filepath="combined_df.json.gz", columns=None):
+    """ Import a gzipped JSON records file written by save_json_records, optionally keeping
+    only some columns """
+    df = load_json_columns(filepath, columns)
+    if "date" in df.columns:
+        if pd.api.types.is_numeric_dtype(df["date"]):
+            df["date"] = pd.to_datetime(df["date"], unit='ms')
+        else:
+            df["date"] = pd.to_datetime(df["date"].astype(str))
+    return df
+
+
+class PageColumns:
+    """ Collects API result pages (lists of record dicts) as typed column chunks, one page
+    at a time, so the records of a page can be dropped as soon as it is converted. Strings
+    are dictionary encoded, so columns that never change (theme, topic, metric...) cost one
+    byte per row and their value is stored once; date columns are parsed to datetime64. """
+
+    def __init__(self, columns=None, date_columns=("date",)):
+        self.columns = columns  # None keeps every column
+        self.date_columns = date_columns
+        self.n_rows = 0
+        self._chunks = {}  # column -> list of per-page arrays
+        self._categories = {}  # string column -> {value: code}
+
+    def add_page(self, records):
+        """ Convert one page of records and append it to the columns """
+        if not records:
+            return
+        columns = self.columns
+        if columns is None:
+            columns = list(self._chunks) + [column for column in records[0] if column not in self._chunks]
+        for column in columns:
+            values = [record.get(column) for record in records]
+            if column in self.date_columns:
+                chunk = np.array(values, dtype="datetime64[D]")
+            elif column in self._categories or any(isinstance(value, str) for value in values):
+                if column not in self._categories and column in self._chunks:
+                    # Earlier pages had no strings (e.g. only nulls): recode them, so nulls stay missing
+                    self._chunks[column] = [self._recode(column, chunk) for chunk in self._chunks[column]]
+                codes = self._categories.setdefault(column, {})
+                chunk = np.array([-1 if value is None else codes.setdefault(value, len(codes)) for value in values],
+                                 dtype=np.int32)
+            elif any(value is None for value in values):
+                chunk = np.array([np.nan if value is None else value for value in values], dtype=float)
+            else:
+                chunk = np.array(values)
+            if column not in self._chunks:
+                self._chunks[column] = [self._missing(column, chunk.dtype, self.n_rows)]
+            self._chunks[column].append(chunk)
+        self.n_rows += len(records)
+
+    def _recode(self, column, chunk):
+        """ Dictionary codes of an earlier, non-string chunk of a column that turned out to hold strings """
+        codes = self._categories.setdefault(column, {})
+        return np.array([-1 if pd.isna(value) else codes.setdefault(value, len(codes)) for value in chunk.tolist()],
+                        dtype=np.int32)
+
+    def _missing(self, column, dtype, n_rows):
+        """ Filler for rows seen before a column first appeared """
+        if column in self._categories:
+            return np.full(n_rows, -1, dtype=np.int32)
+        if column in self.date_columns:
+            return np.full(n_rows, np.datetime64("NaT"), dtype="datetime64[D]")
+        return np.full(n_rows, np.nan) if n_rows else np.empty(0, dtype=dtype)
+
+    def to_frame(self):
+        """ Build the DataFrame; each column is allocated once """
+        data = {}
+        for column, chunks in self._chunks.items():
+            values = np.concatenate(chunks)
+            if column in self._categories:
+                data[column] = pd.Categorical.from_codes(values.astype(_code_dtype(len(self._categories[column]))),
+                                                         categories=list(self._categories[column]))
+            elif column in self.date_columns:
+                data[column] = values.astype("datetime64[ns]")
+            else:
+                data[column] = values
+        return pd.DataFrame(data)
+
+
+def concat_frames(frames):
+    """ Concatenate DataFrames like pd.concat(ignore_index=True), but keep categorical
+    columns categorical when their categories differ (e.g. one borough per frame) """
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    columns = list(frames[0].columns)
+    if len(frames) == 1 or any(list(frame.columns) != columns for frame in frames):
+        return pd.concat(frames, ignore_index=True)
+    data = {}
+    for column in columns:
+        parts = [frame[column] for frame in frames]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            data[column] = union_categoricals(parts, ignore_order=True)
+        else:
+            data[column] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(data)
+
+
+def metrics_wide(df, index=("borough", "date"), value_column="metric_value"):
+    """ Pivot a long frame holding several metrics (one row per borough, metric and date) into
+    one column per metric, indexed by borough and date. Missing combinations are NaN. """
+    wide = df.pivot_table(index=list(index), columns="metric", values=value_column, aggfunc="last",
+                          observed=True)
+    wide.columns = list(wide.columns.astype(str))
+    return wide.reset_index()
+
+
+def save_cases(df, filepath):
+    """ Save the DataFrame, choosing the format from the file extension (.npz or .json.gz) """
+    if filepath.endswith(".json.gz"):
+        save_json_records(df, filepath)
+    else:
+        save_columnar(df, filepath)
+
+
+def load_cases(filepath, columns=None):
+    """ Load the DataFrame, choosing the format from the file extension (.npz or .json.gz),
+    optionally keeping only some columns (e.g. SCHEMA_COLUMNS, so the derived calendar
+    columns of an old JSON export are never decoded) """
+    if filepath.endswith(".json.gz"):
+        return load_json_records(filepath, columns)
+    return load_columnar(filepath, columns)
@@ -0,0 +1,104 @@
+import numpy as np
+
+"""
+Derived series of the daily cases, per borough: a rolling mean, a cumulative total and the
+week-over-week growth of the rolling mean.
+
+Series are computed on the arrays of a CasesIndex (rows sorted by borough, then date; borough
+i in rows offsets[i]:offsets[i + 1]) for every borough in one vectorized pass, and returned as
+arrays aligned with those rows, so plotting a derived series costs the same as plotting the
+raw values. Windows are calendar days, so gaps in the data are handled like pandas'
+rolling("7D"); missing values are skipped.
+
+After a refresh, update() reuses the previous index's series: for each borough only the rows
+from the first changed day (less the window context) are recomputed.
+"""
+
+WINDOW = 7  # days in the rolling window, and the lag of the growth comparison
+
+# name -> description, in the order offered by the dashboard ("daily" is the raw metric value)
+SERIES = {"daily": "Daily cases",
+          "rolling_mean": f"{WINDOW}-day average",
+          "cumulative": "Cumulative cases",
+          "wow_growth": "Week-over-week growth (%)"}
+
+
+def compute(days, values, offsets, window=WINDOW):
+    """ All derived series for rows sorted by (borough, day), with borough i in rows
+    offsets[i]:offsets[i + 1]. Returns {name: float array aligned with the rows}. """
+    days = np.asarray(days, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets)
+    n_rows = len(days)
+    if n_rows == 0:
+        return {name: np.empty(0) for name in SERIES if name != "daily"}
+
+    codes = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    starts = offsets[codes]  # first row of each row's borough
+    # (borough, day) as one sortable key, so a window lookup is one binary search for all rows
+    key = codes * (1 << 32) + (days - days.min())
+    valid = ~np.isnan(values)
+    value_sums = np.concatenate([[0.0], np.cumsum(np.where(valid, values, 0.0))])
+    value_counts = np.concatenate([[0], np.cumsum(valid)])
+
+    def window_mean(end_lag):
+        """ Mean of each row's borough over the days (day - end_lag - window, day - end_lag] """
+        right = np.maximum(np.searchsorted(key, key - end_lag, side="right"), starts)
+        left = np.maximum(np.searchsorted(key, key - end_lag - window, side="right"), starts)
+        count = value_counts[right] - value_counts[left]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(count > 0, (value_sums[right] - value_sums[left]) / count, np.nan)
+
+    rolling_mean = window_mean(0)
+    previous_mean = window_mean(window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        growth = np.where(previous_mean > 0, (rolling_mean / previous_mean - 1) * 100, np.nan)
+    rows = np.arange(n_rows)
+    return {"rolling_mean": rolling_mean,
+            "cumulative": value_sums[rows + 1] - value_sums[starts],
+            "wow_growth": growth}
+
+
+def _first_change(old_days, old_values, new_days, new_values):
+    """ Position of the first row that differs between two sorted series of one borough """
+    common = min(len(old_days), len(new_days))
+    same_values = (old_values[:common] == new_values[:common]) | (np.isnan(old_values[:common]) &
+                                                                  np.isnan(new_values[:common]))
+    changed = np.flatnonzero((old_days[:common] != new_days[:common]) | ~same_values)
+    return changed[0] if len(changed) else common
+
+
+def update(previous, days, values, offsets, boroughs, previous_series, window=WINDOW):
+    """
+    Derived series for new index arrays, reusing previous_series (computed for the CasesIndex `previous`)
+    for every row before the first change in each borough. Returns ({name: array}, rows recomputed).
+    """
+    days = np.asarray(days, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    series = {name: np.empty(len(days)) for name in previous_series}
+    old_positions = {borough: i for i, borough in enumerate(previous.boroughs)}
+    recomputed = 0
+
+    for i, borough in enumerate(boroughs):
+        lo, hi = offsets[i], offsets[i + 1]
+        new_days, new_values = days[lo:hi], values[lo:hi]
+        first = 0
+        if borough in old_positions:
+            j = old_positions[borough]
+            old_lo, old_hi = previous.offsets[j], previous.offsets[j + 1]
+            first = _first_change(previous.days[old_lo:old_hi], previous.values[old_lo:old_hi], new_days, new_values)
+            for name in series:
+                series[name][lo:lo + first] = previous_series[name][old_lo:old_lo + first]
+        if first == hi - lo:
+            continue  # nothing new in this borough
+
+        # Recompute from the first changed day, with enough earlier days for its windows
+        start = np.searchsorted(new_days, new_days[first] - 2 * window, side="right")
+        tail = compute(new_days[start:], new_values[start:], [0, hi - lo - start], window)
+        if start > 0:
+            # the tail's running total starts from zero; continue it from the unchanged rows before it
+            tail["cumulative"] += series["cumulative"][lo + start - 1]
+        for name in series:
+            series[name][lo + first:hi] = tail[name][first - start:]
+        recomputed += hi - lo - start
+    return series, recomputed
@@ -0,0 +1,232 @@
+import argparse
+import datetime
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit
+
+"""
+Local stand-in for the UKHSA dashboard API, for benchmarks and offline testing.
+
+It follows the same paging contract as the real endpoint: metric URLs return
+{"count", "next", "previous", "results"} pages of at most 365 rows, any other query
+parameter filters the rows on the field of the same name, and the geographies URL lists
+the available geography names. The data is synthetic but deterministic: every
+(geography, metric) pair has n_days of daily values from 2020-03-01.
+
+Latency per request, the fraction of requests that fail with 503 and the dataset size
+are configurable. GET /__stats__ returns the number of requests, errors and rows served.
+
+Run it standalone with `python mock_ukhsa_server.py --port 8000`, then point the
+wrapper at it with APIwrapper.use_access_point("http://127.0.0.1:8000").
+"""
+
+MAX_PAGE_SIZE = 365
+FIRST_DATE = datetime.date(2020, 3, 1)
+
+
+class MockUKHSAServer:
+    """ Mock API server running on a background thread. Use it as a context manager, or
+    call start() and stop(). Port 0 picks a free port; the address is in `url`. """
+
+    def __init__(self, n_days=3 * 365, n_geographies=32, latency=0.0, error_rate=0.0, seed=0,
+                 host="127.0.0.1", port=0):
+        self.n_days = n_days
+        self.n_geographies = n_geographies
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._rows = {}  # (geography, metric) -> generated rows, built on first request
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "rows": 0}
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def geographies(self):
+        """ Names of the mock geographies (any other name is served as well) """
+        return [f"Mock Area {i:03d}" for i in range(1, self.n_geographies + 1)]
+
+    def rows(self, path, geography, metric):
+        """ All rows of one (geography, metric) series, generated once and then reused """
+        key = (geography, metric)
+        with self._lock:
+            if key not in self._rows:
+                self._rows[key] = _generate_rows(path, geography, metric, self.n_days)
+            return self._rows[key]
+
+    def fail_next(self):
+        """ Decide whether the current request fails (error_rate of them do) """
+        with self._lock:
+            self.stats["requests"] += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.stats["errors"] += 1
+            return failed
+
+    def count_rows(self, n_rows):
+        with self._lock:
+            self.stats["rows"] += n_rows
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _generate_rows(path, geography, metric, n_days):
+    """ Synthetic daily series for one geography and metric, shaped like the API results """
+    structure = dict(zip(path[0::2], path[1::2]))  # {"themes": ..., "sub_themes": ..., ...}
+    rng = random.Random(zlib.crc32(f"{geography}/{metric}".encode("utf-8")))
+    level = rng.uniform(20, 200)
+    rows = []
+    for day in range(n_days):
+        date = FIRST_DATE + datetime.timedelta(days=day)
+        level = max(0.0, level * rng.uniform(0.9, 1.1))  # random walk, so every series looks different
+        rows.append({"theme": structure.get("themes"), "sub_theme": structure.get("sub_themes"),
+                     "topic": structure.get("topics"), "geography_type": structure.get("geography_types"),
+                     "geography": geography, "geography_code": f"E{zlib.crc32(geography.encode('utf-8')) % 10 ** 8:08d}",
+                     "metric": metric, "metric_group": "cases", "stratum": "default", "sex": "all", "age": "all",
+                     "year": date.year, "month": date.month, "epiweek": date.isocalendar()[1],
+                     "date": date.isoformat(), "metric_value": float(round(level)),
+                     "in_reporting_delay_period": day >= n_days - 5})
+    return rows
+
+
+def _matches(row, filters):
+    """ True when every filter equals the row's field (compared as text, like query strings) """
+    for field, value in filters.items():
+        field_value = row.get(field)
+        if isinstance(field_value, bool):
+            field_value = str(field_value).lower()
+            value = value.lower()
+        if str(field_value) != value:
+            return False
+    return True
+
+
+def _make_handler(server):
+    """ Request handler class bound to one MockUKHSAServer """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+        disable_nagle_algorithm = True  # headers and body are separate writes; don't let the body wait for an ACK
+
+        def log_message(self, format, *args):
+            pass  # no line per request on stderr
+
+        def _send_json(self, status, body):
+            content = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            if parts.path == "/__stats__":
+                return self._send_json(200, server.stats)
+            if server.latency:
+                time.sleep(server.latency)
+            if server.fail_next():
+                return self._send_json(503, {"detail": "Service temporarily unavailable"})
+
+            path = [unquote(segment) for segment in parts.path.strip("/").split("/")]
+            if len(path) == 9 and path[-1] == "geographies":
+                return self._send_json(200, [{"name": name} for name in server.geographies()])
+            if len(path) != 12 or path[8] != "geographies" or path[10] != "metrics":
+                return self._send_json(404, {"detail": "Not found."})
+
+            query = dict(parse_qsl(parts.query))
+            page = int(query.pop("page", 1))
+            page_size = int(query.pop("page_size", 5))
+            query.pop("format", None)
+            if page_size > MAX_PAGE_SIZE or page < 1:
+                return self._send_json(400, {"detail": "Invalid page or page_size"})
+
+            rows = server.rows(path, path[9], path[11])
+            if query:
+                rows = [row for row in rows if _matches(row, query)]
+            results = rows[(page - 1) * page_size:page * page_size]
+
+            def page_url(number):
+                return f"{server.url}{parts.path}?" + urlencode({**query, "page_size": page_size, "page": number})
+
+            server.count_rows(len(results))
+            self._send_json(200, {"count": len(rows),
+                                  "next": page_url(page + 1) if page * page_size < len(rows) else None,
+                                  "previous": page_url(page - 1) if page > 1 else None,
+                                  "results": results})
+
+    return Handler
+
+
+class MockServerProcess:
+    """ Run the mock server in a separate Python process, so its work (and memory) is kept
+    apart from the process being measured. Context manager; the address is in `url`. """
+
+    def __init__(self, n_days=3 * 365, n_geographies=32, latency=0.0, error_rate=0.0, seed=0):
+        self._arguments = ["--days", str(n_days), "--geographies", str(n_geographies), "--latency", str(latency),
+                           "--error-rate", str(error_rate), "--seed", str(seed), "--port", "0"]
+        self._process = None
+        self.url = None
+
+    def __enter__(self):
+        self._process = subprocess.Popen([sys.executable, __file__, *self._arguments], stdout=subprocess.PIPE,
+                                         text=True)
+        self.url = self._process.stdout.readline().split()[-1]  # "Serving mock UKHSA API on <url>"
+        return self
+
+    def __exit__(self, *exc_info):
+        self._process.terminate()
+        self._process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the UKHSA dashboard API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000, help="0 picks a free port")
+    parser.add_argument("--days", type=int, default=3 * 365, help="days of data per geography and metric")
+    parser.add_argument("--geographies", type=int, default=32, help="number of geographies listed")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--seed", type=int, default=0, help="seed for choosing which requests fail")
+    args = parser.parse_args()
+
+    server = MockUKHSAServer(args.days, args.geographies, args.latency, args.error_rate, args.seed,
+                             args.host, args.port)
+    print(f"Serving mock UKHSA API on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import pandas as pd
+import numpy as np
+
+from part_2_wrangle_timeseries import as_days
+
+"""
+Joins the weekly cases (from part_2_wrangle_timeseries) with the lineage data (percentage of
+sequences per strain and week) into weekly cases per strain.
+
+The two datasets don't date their weeks the same way, so instead of an exact-date merge each
+week of cases is matched to the nearest lineage week (an as-of join, done with one binary
+search over all rows). The lineage percentages are kept as one weeks x strains matrix, so the
+cases per strain of every row are a single broadcast multiplication rather than a loop over
+strains. With `by` (e.g. "geography"), the weeks of every geography are joined in the same pass,
+against that geography's own lineage data, or against shared lineage data if it has no such column.
+"""
+
+DIRECTIONS = ("nearest", "backward", "forward")
+
+
+def _as_frame(source):
+    """ A DataFrame given as itself or as the path of a pickle """
+    if isinstance(source, pd.DataFrame):
+        return source
+    return pd.read_pickle(source)
+
+
+def _lineage_frame(lineage_data):
+    """ Lineage data with its dates (the index, in the lineage pickle) as a 'date' column """
+    lineage_data = _as_frame(lineage_data)
+    if "date" not in lineage_data.columns:
+        lineage_data = lineage_data.reset_index()
+        lineage_data = lineage_data.rename(columns={lineage_data.columns[0]: "date"})
+    lineage_data = lineage_data.dropna(subset=["date"])
+    lineage_data["date"] = pd.to_datetime(lineage_data["date"])
+    return lineage_data
+
+
+def _group_codes(cases, lineage, by):
+    """ One integer per group of the `by` columns, numbered the same way in both frames """
+    if not by:
+        return np.zeros(len(cases), dtype=np.int64), np.zeros(len(lineage), dtype=np.int64)
+    cases_codes, lineage_codes, shape = [], [], []
+    for column in by:
+        codes, labels = pd.factorize(pd.concat([cases[column], lineage[column]], ignore_index=True), sort=True)
+        cases_codes.append(codes[:len(cases)])
+        lineage_codes.append(codes[len(cases):])
+        shape.append(len(labels))
+    return np.ravel_multi_index(cases_codes, shape), np.ravel_multi_index(lineage_codes, shape)
+
+
+def match_weeks(days, groups, lineage_days, lineage_groups, direction="nearest", tolerance=3):
+    """
+    Row of the lineage data matched to each week: the nearest (or latest before, or earliest after) lineage
+    day of the same group, at most `tolerance` days away. lineage_days must be sorted by (group, day).
+    Weeks without a match get -1.
+    """
+    if direction not in DIRECTIONS:
+        raise ValueError(f"direction must be one of {DIRECTIONS}, not {direction!r}")
+    if len(lineage_days) == 0:
+        return np.full(len(days), -1)
+    origin = min(days.min(), lineage_days.min()) if len(days) else 0
+    # (group, day) as one sortable key, so every week is matched with one binary search
+    key = groups * (1 << 32) + (days - origin)
+    lineage_key = lineage_groups * (1 << 32) + (lineage_days - origin)
+
+    n = len(lineage_key)
+    before = np.searchsorted(lineage_key, key, side="right") - 1  # last lineage day <= the week
+    after = np.searchsorted(lineage_key, key, side="left")  # first lineage day >= the week
+    distance_before = np.where(before >= 0, key - lineage_key[np.clip(before, 0, n - 1)], np.inf)
+    distance_after = np.where(after < n, lineage_key[np.clip(after, 0, n - 1)] - key, np.inf)
+
+    if direction == "backward":
+        match, distance = before, distance_before
+    elif direction == "forward":
+        match, distance = after, distance_after
+    else:
+        use_after = distance_after < distance_before
+        match = np.where(use_after, after, before)
+        distance = np.where(use_after, distance_after, distance_before)
+    # a key of another group is at least 2**32 days away, so the tolerance also keeps groups apart
+    return np.where(distance <= tolerance, match, -1)
+
+
+def prepare_data(weekly_cases_path="data/weekly_cases.pkl", lineage_data_path="data/lineagedf.pkl",
+                 value_column="cases", by=(), direction="nearest", tolerance=pd.Timedelta(days=3)):
+    """
+    Loads weekly cases and lineage data (in percentage), and returns the weekly cases per strain.
+
+    Both inputs can be file paths (pickles) or DataFrames. The weekly cases have a 'week_start' column and
+    value_column; the lineage data has one column per strain and its dates as the index or a 'date' column.
+    Each week is joined to the lineage week chosen by `direction`, within `tolerance`; weeks without lineage
+    data are left out. With `by`, weeks are only joined to lineage data of the same group, unless the lineage
+    data has none of the `by` columns, in which case it applies to every group.
+
+    Returns the `by` columns, 'week_start', value_column, 'date' (the matched lineage week) and the cases
+    of every strain, in the order of the weekly cases.
+    """
+    weekly_cases = _as_frame(weekly_cases_path)
+    lineage_data = _lineage_frame(lineage_data_path)
+    by = [by] if isinstance(by, str) else list(by)
+    shared = not any(column in lineage_data.columns for column in by)  # one lineage table for every group
+    lineage_by = [] if shared else by
+    strain_columns = [column for column in lineage_data.columns if column not in ["date", *lineage_by]]
+
+    weekly_cases = weekly_cases.dropna(subset=["week_start", *lineage_by])
+    lineage_data = lineage_data.dropna(subset=lineage_by)
+    groups, lineage_groups = _group_codes(weekly_cases, lineage_data, lineage_by)
+    lineage_days = as_days(lineage_data["date"])
+    order = np.lexsort((lineage_days, lineage_groups))
+
+    if isinstance(tolerance, pd.Timedelta):
+        tolerance = tolerance / pd.Timedelta(days=1)
+    matched = match_weeks(as_days(weekly_cases["week_start"]), groups, lineage_days[order], lineage_groups[order],
+                          direction, tolerance)
+    found = matched >= 0
+    rows = order[matched[found]]  # rows of lineage_data
+
+    # Cases per strain: the weeks' cases times the matched rows of the strain percentage matrix, in one go
+    fractions = lineage_data[strain_columns].to_numpy(dtype=np.float64) / 100
+    cases = weekly_cases[value_column].to_numpy(dtype=np.float64)[found]
+    strain_cases = cases[:, None] * fractions[rows]
+
+    merged_data = weekly_cases.loc[found, [*by, "week_start", value_column]].reset_index(drop=True)
+    merged_data["date"] = lineage_data["date"].to_numpy()[rows]
+    return pd.concat([merged_data, pd.DataFrame(strain_cases, columns=strain_columns)], axis=1)
+
+
+def save_prepared_data(merged_data, output_path):
+    """Save prepared data for visualization."""
+    merged_data.to_csv(output_path, index=False)
+    print(f"Data saved to {output_path}")
+
+
+if __name__ == "__main__":
+    # File paths
+    weekly_cases_path = "data/weekly_cases.pkl"
+    lineage_data_path = "data/lineagedf.pkl"
+    output_path = "data/merged_lineage_cases.csv"
+
+    # Load and prepare data
+    merged_data = prepare_data(weekly_cases_path, lineage_data_path)
+
+    # Save the prepared data
+    save_prepared_data(merged_data, output_path)
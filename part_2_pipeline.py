@@ -0,0 +1,179 @@
+import os
+import glob
+import time
+import pickle
+import hashlib
+import inspect
+
+import part_2_wrangle_timeseries
+from part_2_wrangle_timeseries import load_timeseries, clean_timeseries, group_by_week
+from part_2_merge_linear_cases import prepare_data
+from part_2_visualise_lineages_cases import LineageVisualiser
+
+"""
+Runs the part 2 chain (load_timeseries -> clean_timeseries -> group_by_week -> prepare_data ->
+LineageVisualiser) as declared stages, instead of scripts linked by weekly_cases.pkl and
+merged_lineage_cases.csv.
+
+Each stage names the earlier stages and the files it reads, and its parameters. Its cache key
+is a hash of those: the contents of its files, its parameters, the source code of the module
+defining its function (so helpers like resample or match_weeks count too) and of any other code
+it declares, and the keys of the stages it reads from. A stage whose key has a cached output is
+not run; the output is loaded from the cache only if it is needed (by a stage that has to run,
+or as the result). Outputs are passed on in memory and cached as pickles in cache_dir, so frames
+keep their dtypes and there is no CSV round-trip.
+"""
+
+CACHE_DIR = "pipeline_cache"
+
+
+class Stage:
+    def __init__(self, name, function, inputs=(), files=(), params=None, code=(), cache=True):
+        """
+        A step of the pipeline: function(*outputs of `inputs`, *`files`, **params).
+        inputs are names of earlier stages; files are paths read by the function. code lists the functions or
+        modules from other modules that the function relies on; their modules' source is part of the cache key,
+        like the function's own module. Stages with cache=False (e.g. ones returning widgets) always run when they
+        are needed.
+        """
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.files = tuple(files)
+        self.params = dict(params or {})
+        self.code = tuple(code)
+        self.cache = cache
+
+    def __repr__(self):
+        return f"Stage({self.name!r})"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """ SHA-1 of a file's contents """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def code_digest(objects):
+    """ Hash of the source code of the modules defining the given functions or classes (modules can
+    also be given directly). A module whose source isn't available is hashed by its name. """
+    digest = hashlib.sha1()
+    modules = []
+    for obj in objects:
+        module = obj if inspect.ismodule(obj) else inspect.getmodule(obj)
+        if module is not None and module not in modules:
+            modules.append(module)
+    for module in modules:
+        try:
+            source = inspect.getsource(module)
+        except (OSError, TypeError):
+            source = module.__name__
+        digest.update(source.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class Pipeline:
+    def __init__(self, stages, cache_dir=CACHE_DIR):
+        self.stages = {}
+        for stage in stages:
+            missing = [name for name in stage.inputs if name not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {stage.name!r} reads {missing}, which are not earlier stages")
+            self.stages[stage.name] = stage
+        self.cache_dir = cache_dir
+        self._file_digests = {}  # (path, size, mtime) -> digest, so unchanged files are hashed once
+        self.report = []
+
+    def _file_key(self, path):
+        status = os.stat(path)
+        signature = (os.path.abspath(path), status.st_size, status.st_mtime_ns)
+        if signature not in self._file_digests:
+            self._file_digests[signature] = file_digest(path)
+        return self._file_digests[signature]
+
+    def keys(self):
+        """ Cache key of every stage, in order """
+        keys = {}
+        for name, stage in self.stages.items():
+            contents = repr((name, code_digest([stage.function, *stage.code]), sorted(stage.params.items()),
+                             [(path, self._file_key(path)) for path in stage.files],
+                             [keys[upstream] for upstream in stage.inputs]))
+            keys[name] = hashlib.sha1(contents.encode("utf-8")).hexdigest()[:12]
+        return keys
+
+    def _cache_path(self, name, key):
+        return os.path.join(self.cache_dir, f"{name}_{key}.pkl")
+
+    def _store(self, name, key, output):
+        """ Cache a stage's output, replacing its outdated versions """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(name, key)
+        partial_path = path + ".partial"
+        with open(partial_path, "wb") as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(partial_path, path)  # a crash mid-write never leaves a half-written output
+        for old_path in glob.glob(self._cache_path(name, "*")):
+            if old_path != path:
+                os.remove(old_path)
+
+    def is_current(self, name, keys=None):
+        """ Whether a stage's cached output matches its inputs, files, parameters and code """
+        keys = keys or self.keys()
+        return self.stages[name].cache and os.path.exists(self._cache_path(name, keys[name]))
+
+    def run(self, target=None, force=()):
+        """
+        Bring the pipeline up to date up to `target` (default: the last stage) and return its output.
+        Stages named in force are run even if they are current. self.report lists what each stage did.
+        """
+        target = target or list(self.stages)[-1]
+        keys = self.keys()
+        outputs = {}
+        self.report = []
+
+        def output_of(name):
+            if name in outputs:
+                return outputs[name]
+            stage = self.stages[name]
+            start = time.perf_counter()
+            if name not in force and self.is_current(name, keys):
+                with open(self._cache_path(name, keys[name]), "rb") as f:
+                    outputs[name] = pickle.load(f)
+                action = "loaded"
+            else:
+                arguments = [output_of(upstream) for upstream in stage.inputs]
+                start = time.perf_counter()  # the time of this stage only, without its inputs
+                outputs[name] = stage.function(*arguments, *stage.files, **stage.params)
+                if stage.cache:
+                    self._store(name, keys[name], outputs[name])
+                action = "ran"
+            self.report.append({"stage": name, "action": action, "key": keys[name],
+                                "seconds": time.perf_counter() - start})
+            print(f"✓ {name}: {action} in {time.perf_counter() - start:.2f}s")
+            return outputs[name]
+
+        return output_of(target)
+
+
+def lineage_pipeline(timeseries_path="data/timeseries.json", lineage_data_path="data/lineagedf.pkl",
+                     cache_dir=CACHE_DIR, direction="nearest", kind="area"):
+    """
+    The part 2 chain, from the timeseries JSON and the lineage pickle to a LineageVisualiser.
+    """
+    return Pipeline([
+        Stage("timeseries", load_timeseries, files=[timeseries_path]),
+        Stage("cleaned", clean_timeseries, inputs=["timeseries"]),
+        Stage("weekly_cases", group_by_week, inputs=["cleaned"]),
+        Stage("merged", prepare_data, inputs=["weekly_cases"], files=[lineage_data_path],
+              params={"direction": direction}, code=[part_2_wrangle_timeseries]),  # prepare_data uses as_days
+        Stage("visualiser", LineageVisualiser, inputs=["merged"], params={"kind": kind}, cache=False),
+    ], cache_dir)
+
+
+if __name__ == "__main__":
+    # Example usage: only the stages whose inputs changed since the last run are recomputed
+    visualiser = lineage_pipeline().run()
+    visualiser.interactive_plot()
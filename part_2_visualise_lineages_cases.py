@@ -0,0 +1,200 @@
+import io
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+import ipywidgets as widgets
+from matplotlib.collections import PolyCollection
+from IPython.display import display
+
+"""
+Interactive stacked chart of the weekly cases per strain (the output of part_2_merge_linear_cases).
+
+The strain columns are turned once into a strains x weeks matrix (summed over geographies, if the
+data has several) with its cumulative sum down the strains, which is the stacked chart of every
+strain. The figure is created once, with one PolyCollection per strain (kind="area": a stepped
+area with one step per week; kind="bar": one rectangle per week, like a stacked bar chart but a
+single artist per strain), and a new strain selection only reshapes and hides those artists,
+restacking just the selected strains.
+"""
+
+KINDS = ("area", "bar")
+NON_STRAIN_COLUMNS = ("week_start", "cases", "date")
+
+
+class LineageVisualiser:
+    def __init__(self, data=None, kind="area"):
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {KINDS}, not {kind!r}")
+        self.kind = kind
+        self.data = None
+        self.strain_columns = None
+        self.fig = self.ax = None
+        if data is not None:
+            self.set_data(data)
+
+    def load_data(self, file_path):
+        """
+        Load merged data from a CSV file.
+        """
+        self.set_data(pd.read_csv(file_path, parse_dates=["week_start"]))
+        print(f"Data loaded with {len(self.data)} rows and {len(self.strain_columns)} strain columns.")
+
+    def set_data(self, data):
+        """
+        Use merged data (a DataFrame) and precompute the arrays every plot is drawn from.
+        """
+        data = data.copy()
+        data["week_start"] = pd.to_datetime(data["week_start"])
+        self.data = data
+        self.strain_columns = [col for col in data.columns
+                               if col not in NON_STRAIN_COLUMNS and pd.api.types.is_numeric_dtype(data[col])]
+
+        weekly = data.groupby("week_start", sort=True)[self.strain_columns].sum()
+        self.weeks = weekly.index.to_numpy(dtype="datetime64[D]")
+        self.values = weekly.to_numpy(dtype=np.float64).T  # strains x weeks
+        self.cumulative = np.cumsum(self.values, axis=0)  # stacked tops of all strains, in column order
+        # Week edges on the matplotlib date axis: each week spans to the next (the last one spans 7 days)
+        x = mdates.date2num(self.weeks)
+        self.edges = np.append(x, x[-1] + 7) if len(x) else x
+        self.fig = self.ax = None  # new data: the artists are created again on the next render
+
+    def _create_figure(self):
+        self.fig, self.ax = plt.subplots(figsize=(16, 6))
+        plt.close(self.fig)  # keep it away from the inline backend, we display the PNGs ourselves
+        locator = mdates.AutoDateLocator()
+        self.ax.xaxis.set_major_locator(locator)
+        self.ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        self.ax.set_title("Weekly Cases Per Strain (Stacked)")
+        self.ax.set_xlabel("Week Start")
+        self.ax.set_ylabel("Cases per 100,000 People")
+        self.ax.grid(axis='y', linestyle='--', alpha=0.7)
+        self.artists = {}  # strain position -> its PolyCollection, created when the strain is first shown
+        self.colours = plt.get_cmap("tab20")
+
+    def _artist(self, position):
+        if position not in self.artists:
+            colour = self.colours(position % self.colours.N)
+            label = self.strain_columns[position]
+            artist = PolyCollection([], facecolors=[colour], edgecolors="none", label=label)
+            self.ax.add_collection(artist)
+            self.artists[position] = artist
+        return self.artists[position]
+
+    def selection(self, strains=None):
+        """
+        Positions (in strain_columns) of the selected strains; None or "All" selects every strain.
+        """
+        if strains is None or "All" in strains:
+            return np.arange(len(self.strain_columns))
+        positions = {strain: position for position, strain in enumerate(self.strain_columns)}
+        return np.array(sorted(positions[strain] for strain in strains), dtype=np.int64)
+
+    def stack(self, positions):
+        """
+        Lower and upper edges (strains x weeks) of the selected strains stacked in column order.
+        """
+        if len(positions) == len(self.strain_columns):
+            upper = self.cumulative
+        else:
+            upper = np.cumsum(self.values[positions], axis=0)
+        return upper - self.values[positions], upper
+
+    def shapes(self, lower, upper):
+        """
+        Polygons of each stacked strain (one list per row of lower/upper), as PolyCollection vertices.
+        """
+        if self.kind == "area":
+            # Stepped outline: along the top edge, then back along the bottom edge
+            steps = np.repeat(self.edges, 2)[1:-1]
+            xs = np.broadcast_to(np.concatenate([steps, steps[::-1]]), (len(upper), 4 * len(self.weeks)))
+            ys = np.concatenate([np.repeat(upper, 2, axis=1), np.repeat(lower, 2, axis=1)[:, ::-1]], axis=1)
+            return np.stack([xs, ys], axis=-1)[:, None]
+        # One rectangle per week, 80% of the week wide
+        left, right = self.edges[:-1], self.edges[:-1] + np.diff(self.edges) * 0.8
+        xs = np.broadcast_to(np.stack([left, left, right, right], axis=-1), (len(upper), len(self.weeks), 4))
+        ys = np.stack([lower, upper, upper, lower], axis=-1)
+        return np.stack([xs, ys], axis=-1)
+
+    def update(self, strains=None):
+        """
+        Show the selected strains, stacked, on the long-lived figure.
+        """
+        if self.fig is None:
+            self._create_figure()
+        positions = self.selection(strains)
+        lower, upper = self.stack(positions)
+        shapes = self.shapes(lower, upper)
+
+        shown = set(positions.tolist())
+        for position, artist in self.artists.items():
+            if position not in shown:
+                artist.set_visible(False)
+        for row, position in enumerate(positions):
+            artist = self._artist(position)
+            artist.set_visible(True)
+            artist.set_verts(shapes[row])
+
+        top = upper[-1].max() if upper.size else 0
+        self.ax.set_xlim(self.edges[0], self.edges[-1])
+        self.ax.set_ylim(0, top + (0.1 * top) if top > 0 else 1)  # Add 10% padding for visual clarity
+        handles = [self.artists[position] for position in positions]
+        self.ax.legend(handles=handles, title="Strain", bbox_to_anchor=(1.05, 1), loc='upper left',
+                       fontsize="small", ncol=1 + len(handles) // 30)
+        self.fig.tight_layout()
+
+    def render(self, strains=None):
+        """
+        Draw the selected strains and return the figure as PNG bytes.
+        """
+        self.update(strains)
+        buffer = io.BytesIO()
+        self.fig.savefig(buffer, format="png")
+        return buffer.getvalue()
+
+    def interactive_plot(self):
+        """
+        Interactive plot with dynamic y-axis limits based on strain selection.
+        """
+        if self.data is None or self.data.empty:
+            raise ValueError("No data available to plot. Please load the data first.")
+
+        # Create strain dropdown
+        strain_dropdown = widgets.SelectMultiple(
+            options=["All"] + self.strain_columns,
+            value=["All"],
+            description="Strains:",
+            layout=widgets.Layout(width='50%'),
+            style={'description_width': 'initial'}
+        )
+
+        # The figure is drawn to PNG and shown in an Image widget, so updates replace the picture in place
+        image = widgets.Image(format="png")
+
+        def update_plot(change=None):
+            image.value = self.render(list(strain_dropdown.value))
+
+        # Link the dropdown to the plot
+        strain_dropdown.observe(update_plot, names='value')
+
+        # Display widgets
+        display(widgets.VBox([strain_dropdown, image]))
+
+        # Trigger the first plot
+        update_plot()
+
+
+# Example Usage
+if __name__ == "__main__":
+    # Initialize the visualiser
+    visualiser = LineageVisualiser()
+
+    # Load the data
+    try:
+        visualiser.load_data("data/merged_lineage_cases.csv")
+    except Exception as e:
+        print(f"Error loading data: {e}")
+        raise
+
+    # Show the interactive plot
+    visualiser.interactive_plot()
@@ -0,0 +1,202 @@
+import pandas as pd
+import numpy as np
+import json
+from datetime import datetime
+
+"""
+This is a data wrangling file that I have written (instead of the provided Jupyter Notebook) for better modularity.
+There are three steps to wrangling this:
+1. Load the timeseries file
+2. Group the data by week (because we will be comparing against lineages which is a weekly dat)
+3. Clean timeseris if there are any null fields
+
+Grouping is done by a small resampling engine (resample) that works on integer day numbers
+(days since 1970-01-01) instead of datetime accessors: ISO weeks, months and quarters are
+plain integer arithmetic, and every geography and metric is aggregated in one grouped pass
+with np.bincount. That keeps the weekly roll-up of every LTLA in the milliseconds.
+"""
+
+FREQUENCIES = ("week", "month", "quarter")
+AGGREGATIONS = ("sum", "mean", "count")
+
+
+def load_timeseries(file_path):
+    # TODO open the timeseries JSON provided
+    with open(file_path, 'r') as f:
+        rawdata = json.load(f)
+
+    # TODO convert to dataframe and ensure date is converted to datetime
+    if "data" in rawdata:
+        df = pd.DataFrame(rawdata["data"])  # Convert to DataFrame
+    else:
+        raise KeyError("The rawdata does not contain the 'data' key")
+
+    # TODO check if 'date' column exists
+    if "date" not in df.columns:
+        raise KeyError("The DataFrame does not contain a 'date' column")
+
+    # Convert 'date' column to datetime
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+
+    # Drop rows where 'date' could not be converted
+    if df['date'].isna().any():
+        print("Warning: Some dates could not be converted and will be dropped.")
+        df = df.dropna(subset=['date'])
+
+    return df
+
+
+def as_days(dates):
+    """ Integer days since 1970-01-01 of a date column (datetimes, or day numbers as in the compact schema) """
+    dates = np.asarray(dates)
+    if dates.dtype.kind in "iu":
+        return dates.astype(np.int64)
+    return dates.astype("datetime64[D]").astype(np.int64)
+
+
+def bucket_index(days, freq="week"):
+    """ Number of the week (starting on Monday), month or quarter each day number falls in,
+    counted from 1970. Consecutive buckets have consecutive numbers. """
+    days = np.asarray(days, dtype=np.int64)
+    if freq == "week":
+        return (days + 3) // 7  # 1970-01-01 was a Thursday, so week 0 started on Monday 1969-12-29
+    months = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    if freq == "month":
+        return months
+    if freq == "quarter":
+        return months // 3
+    raise ValueError(f"freq must be one of {FREQUENCIES}, not {freq!r}")
+
+
+def bucket_start(buckets, freq="week"):
+    """ First day (as datetime64) of the buckets numbered by bucket_index """
+    buckets = np.asarray(buckets, dtype=np.int64)
+    if freq == "week":
+        return (buckets * 7 - 3).astype("datetime64[D]")
+    months = buckets * 3 if freq == "quarter" else buckets
+    return months.astype("datetime64[M]").astype("datetime64[D]")
+
+
+def _rolling_sum(matrix, window):
+    """ Sum of each row's last `window` columns, for every column (fewer at the start) """
+    cumulative = np.cumsum(matrix, axis=1)
+    rolled = cumulative.copy()
+    rolled[:, window:] -= cumulative[:, :-window]
+    return rolled
+
+
+def resample(df, freq="week", value_column="metric_value", by=("geography", "metric"), how="sum",
+             rolling=None, min_periods=None, date_column="date"):
+    """
+    Aggregate a daily long frame into weekly (ISO, Monday start), monthly or quarterly buckets for every
+    combination of the `by` columns at once.
+
+    how is "sum", "mean" or "count" of the daily values in each bucket (missing values are skipped).
+    With rolling=n, each bucket's value is instead the mean of the last n bucket aggregates of its group
+    (e.g. how="sum", rolling=4: a 4-week rolling mean of weekly totals); buckets with fewer than
+    min_periods (default n) non-empty buckets in the window are NaN.
+
+    Returns one row per group and non-empty bucket, sorted by group and date, with the `by` columns,
+    f"{freq}_start" (datetime64), value_column and "days" (number of daily values in the bucket).
+    """
+    if how not in AGGREGATIONS:
+        raise ValueError(f"how must be one of {AGGREGATIONS}, not {how!r}")
+    by = [by] if isinstance(by, str) else [column for column in by if column in df.columns]
+    start_column = f"{freq}_start"
+    if df.empty:
+        return pd.DataFrame(columns=[*by, start_column, value_column, "days"])
+
+    # One integer code per group: combine the codes of the `by` columns (categoricals already are codes)
+    level_codes, level_labels = [], []
+    for column in by:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            codes, labels = df[column].cat.codes.to_numpy(np.int64), df[column].cat.categories
+        else:
+            codes, labels = pd.factorize(df[column], sort=True)
+        level_codes.append(codes)
+        level_labels.append(labels)
+    shape = [max(len(labels), 1) for labels in level_labels]
+    if by:
+        keep = np.logical_and.reduce([codes >= 0 for codes in level_codes])  # like groupby, skip missing keys
+        keep = slice(None) if keep.all() else keep  # no copies when nothing is missing
+        combined = np.ravel_multi_index([codes[keep] for codes in level_codes], shape)
+    else:
+        keep = slice(None)
+        combined = np.zeros(len(df), dtype=np.int64)
+    # Number the groups that occur, in key order (a bincount, so no sort is needed)
+    occurring = np.bincount(combined, minlength=int(np.prod(shape))) > 0
+    group_keys = np.flatnonzero(occurring)
+    group_codes = (np.cumsum(occurring) - 1)[combined]
+    n_groups = len(group_keys)
+
+    values = df[value_column].to_numpy(dtype=np.float64)[keep]
+    present = ~np.isnan(values)
+    buckets = bucket_index(as_days(df[date_column])[keep], freq)
+    first, n_buckets = buckets.min(), buckets.max() - buckets.min() + 1
+
+    # Dense groups x buckets grid, filled in one pass
+    cell = group_codes * n_buckets + (buckets - first)
+    size = n_groups * n_buckets
+    if not present.all():
+        cell, values, all_cells = cell[present], values[present], cell
+    counts = np.bincount(cell, minlength=size).reshape(n_groups, n_buckets)
+    totals = np.bincount(cell, weights=values, minlength=size).reshape(n_groups, n_buckets)
+    # a bucket exists when the group has any row in it, even if all its values are missing
+    exists = counts > 0 if present.all() else np.bincount(all_cells, minlength=size).reshape(n_groups, n_buckets) > 0
+
+    if how == "sum":
+        aggregate = np.where(counts > 0, totals, np.nan)
+    elif how == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            aggregate = totals / counts
+    else:
+        aggregate = counts.astype(np.float64)
+
+    if rolling:
+        valid = ~np.isnan(aggregate)
+        window_totals = _rolling_sum(np.where(valid, aggregate, 0.0), rolling)
+        window_counts = _rolling_sum(valid.astype(np.int64), rolling)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            aggregate = np.where(window_counts >= (min_periods or rolling), window_totals / window_counts, np.nan)
+
+    group_index, bucket_offset = np.nonzero(exists)
+    result = {}
+    if by:
+        for column, codes, labels in zip(by, np.unravel_index(group_keys[group_index], shape), level_labels):
+            result[column] = (pd.Categorical.from_codes(codes, categories=labels)
+                              if isinstance(df[column].dtype, pd.CategoricalDtype) else np.asarray(labels)[codes])
+    result[start_column] = bucket_start(first + bucket_offset, freq).astype("datetime64[ns]")
+    result[value_column] = aggregate[group_index, bucket_offset]
+    result["days"] = counts[group_index, bucket_offset]
+    return pd.DataFrame(result)
+
+
+def group_by_week(df, value_column="cases", by=()):
+    """Aggregate daily cases into weekly cases (weeks start on Monday), per group of the `by` columns if given."""
+    weekly_cases = resample(df, "week", value_column, by=by, how="sum")
+
+    # Same columns as before (plus the groups, if any): the weekly total and the Monday the week starts on
+    return weekly_cases[[*weekly_cases.columns[:-3], value_column, "week_start"]]
+
+
+def clean_timeseries(df):
+    """Clean the timeseries DataFrame."""
+
+    # TODO drop rows with NaN values in 'cases' to ensure data integrity
+    df = df.dropna(subset=['cases'])
+
+    # TODO ensure 'cases' column is numeric
+    df.loc[:, 'cases'] = pd.to_numeric(df['cases'], errors='coerce')
+
+    return df
+
+
+# Data testing
+if __name__ == "__main__":
+    # Example usage
+    file_path = "data/timeseries.json"
+    df = load_timeseries(file_path)
+    df = clean_timeseries(df)
+    weekly_cases = group_by_week(df)
+    print(weekly_cases.head(20))
+    weekly_cases.to_pickle("data/weekly_cases.pkl")
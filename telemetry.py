@@ -0,0 +1,160 @@
+import json
+import threading
+import time
+from collections import Counter
+import pandas as pd
+
+"""
+Structured telemetry for the fetch pipeline.
+
+Code being measured emits events (plain dicts) to a Telemetry object, which hands them
+to its sinks. The events are:
+- "request": one API request, with url, status, bytes, rows, cached, and the seconds spent
+  waiting for the rate limiter (rate_limit_wait_s), on the network (network_s) and
+  decoding the JSON (parse_s)
+- "convert": one result page turned into typed columns (rows, convert_s)
+- "error": an exception, with its message
+- "borough": summary of one (borough, metric) fetch job: rows, wall seconds, the totals
+  of its requests and the error if it failed
+- "fetch_started" (number of jobs, and whether they are boroughs or shards), "shard" and
+  "fetch_finished": progress of a whole fetch
+
+Telemetry.bind(borough=..., metric=...) returns a Telemetry that adds those fields to
+every event and keeps running totals, which is how the per-borough summaries are built.
+A Telemetry without sinks costs next to nothing, so it is always safe to emit.
+
+Sinks are objects with a handle(event) method: MetricsSink keeps everything in memory
+and summarises where the time went, LogFileSink writes JSON lines, and ProgressBarSink
+drives an ipywidgets progress bar.
+"""
+
+# fields of "request" and "convert" events that are added up into the totals
+TOTAL_FIELDS = {"request": ("bytes", "rate_limit_wait_s", "network_s", "parse_s"),
+                "convert": ("rows", "convert_s")}
+
+
+class Telemetry:
+    """ Fans events out to sinks. Safe to share between threads. """
+
+    def __init__(self, sinks=(), **tags):
+        self._sinks = list(sinks)  # shared with bound children, so sinks added later see their events too
+        self.tags = tags
+        self.totals = Counter()
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        self._sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink):
+        if sink in self._sinks:
+            self._sinks.remove(sink)
+
+    def bind(self, **tags):
+        """ Telemetry with the same sinks that adds `tags` to every event and keeps its own totals """
+        child = Telemetry(**{**self.tags, **tags})
+        child._sinks = self._sinks
+        return child
+
+    def emit(self, event, **fields):
+        """ Send one event to every sink. Request and convert events also count towards totals. """
+        record = {"event": event, "time": time.time(), **self.tags, **fields}
+        if event in TOTAL_FIELDS:
+            with self._lock:
+                self.totals["requests"] += event == "request"
+                for field in TOTAL_FIELDS[event]:
+                    self.totals[field] += fields.get(field) or 0
+        for sink in list(self._sinks):
+            sink.handle(record)
+        return record
+
+
+class MetricsSink:
+    """ Keeps every event in memory and breaks the fetch time down by where it was spent """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def handle(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+
+    def frame(self, event):
+        """ All events of one type as a DataFrame, e.g. frame("request") or frame("borough") """
+        with self._lock:
+            return pd.DataFrame([record for record in self.events if record["event"] == event])
+
+    def summary(self):
+        """ Totals over all requests, and the seconds spent pacing, on the network, decoding JSON
+        and converting pages. Worker threads overlap, so the parts can add up to more than the
+        wall time of the fetch. """
+        requests, converts = self.frame("request"), self.frame("convert")
+
+        def column_sum(frame, column):
+            return float(frame[column].sum()) if column in frame else 0.0
+
+        return {"requests": len(requests),
+                "cached_requests": int(requests["cached"].sum()) if "cached" in requests else 0,
+                "errors": len(self.frame("error")),
+                "bytes": column_sum(requests, "bytes"),
+                "rows": column_sum(converts, "rows"),
+                "rate_limit_wait_s": column_sum(requests, "rate_limit_wait_s"),
+                "network_s": column_sum(requests, "network_s"),
+                "parse_s": column_sum(requests, "parse_s"),
+                "convert_s": column_sum(converts, "convert_s")}
+
+
+class LogFileSink:
+    """ Appends every event to a file as one JSON object per line """
+
+    def __init__(self, path="fetch_log.jsonl"):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def handle(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ProgressBarSink:
+    """ Drives an ipywidgets IntProgress bar: fetch_started sets its maximum to the number of
+    jobs, and every finished job ("borough" events, or "shard" events for a sharded fetch)
+    moves it on by one """
+
+    def __init__(self, progress):
+        self.progress = progress
+        self._unit = "borough"
+        self._lock = threading.Lock()
+
+    def handle(self, event):
+        with self._lock:
+            if event["event"] == "fetch_started":
+                self._unit = event.get("unit", "borough")
+                self.progress.max = max(event["jobs"], 1)
+                self.progress.value = 0
+                self.progress.bar_style = ""
+                self.progress.description = "Fetching"
+            elif event["event"] == self._unit:
+                self.progress.value = min(self.progress.value + 1, self.progress.max)
+                if event.get("error"):
+                    self.progress.bar_style = "warning"
+            elif event["event"] == "fetch_finished" and event.get("cancelled"):
+                self.progress.description = "Cancelled"  # the bar stays where the fetch stopped
+                self.progress.bar_style = "warning"
+            elif event["event"] == "fetch_finished":
+                self.progress.value = self.progress.max
+                self.progress.description = "Done"
+                if self.progress.bar_style != "warning":
+                    self.progress.bar_style = "success"